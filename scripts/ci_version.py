@@ -1,20 +1,55 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import os
 import re
+import sys
+import tomllib
 from pathlib import Path
 
 
-_SECTION_RE = re.compile(r"^\s*\[(?P<name>[^\]]+)\]\s*$")
-# 修改后的正则表达式，不包含换行符在 suffix 中
-_VERSION_LINE_RE = re.compile(r"^(?P<prefix>\s*version\s*=\s*)\"(?P<value>[^\"]*)\"(?P<suffix>\s*)$")
+_BASE_RE = re.compile(r"\d+(?:\.\d+)*")
+# Supported: -alpha.1/-a1, -beta.2/-b2, -rc.3/-rc3
+# Also support: -dev.4, -post.5, -pre.6/-preview.6
+_SUFFIX_RE = re.compile(r"(alpha|a|beta|b|rc|pre|preview|dev|post)\.?(\d+)", re.IGNORECASE)
+_LABEL_TO_PEP440 = {
+    "alpha": "a",
+    "a": "a",
+    "beta": "b",
+    "b": "b",
+    "rc": "rc",
+    # Map generic "pre" to rc for PEP 440 compatibility.
+    "pre": "rc",
+    "preview": "rc",
+    "dev": ".dev",
+    # Note: post releases are not pre-releases, but tag naming used '-' so treat as special.
+    "post": ".post",
+}
+
+# version 行：MULTILINE 下 $ 只匹配换行符之前的位置而不消耗它，原有换行符保持不变
+_VERSION_LINE_PATTERN = (
+    r"(?P<prefix>[ \t]*version[ \t]*=[ \t]*)\"(?P<value>[^\"\n]*)\"(?P<suffix>[ \t]*(?:#[^\r\n]*)?)\r?$"
+)
+# 从 [project] 节头开始，逐行跳过非节头行，直到遇到 version 行；
+# 中途遇到其他节头则匹配失败，整个查找只需一次 search
+_PROJECT_VERSION_RE = re.compile(
+    r"^[ \t]*\[[ \t]*project[ \t]*\][ \t]*(?:#.*)?\r?$"
+    r"(?:\n(?![ \t]*\[).*)*?"
+    r"\n" + _VERSION_LINE_PATTERN,
+    re.MULTILINE,
+)
+_MISSING_VERSION_MESSAGE = (
+    "Could not find [project].version in pyproject.toml. "
+    "Expected a line like: version = \"1.2.3\" under [project]."
+)
 
 
 class VersionError(ValueError):
     pass
 
 
+@functools.lru_cache(maxsize=32)
 def tag_to_pep440(tag: str) -> tuple[str, bool]:
     tag = tag.strip()
     if tag.startswith("refs/tags/"):
@@ -24,31 +59,25 @@ def tag_to_pep440(tag: str) -> tuple[str, bool]:
         raise VersionError(f"Tag must start with 'v', got: {tag!r}")
 
     raw = tag[1:]
-    is_prerelease = "-" in raw
+    base, dash, suffix = raw.partition("-")
+    is_prerelease = bool(dash)
 
     if not is_prerelease:
         # Accept already-valid-ish release versions like 1.2.3
-        if not re.fullmatch(r"\d+(?:\.\d+)*", raw):
+        if not _BASE_RE.fullmatch(raw):
             raise VersionError(
                 "Release tag must look like v<digits[.digits...]>, "
                 f"got: {tag!r}"
             )
         return raw, False
 
-    base, suffix = raw.split("-", 1)
-    if not re.fullmatch(r"\d+(?:\.\d+)*", base):
+    if not _BASE_RE.fullmatch(base):
         raise VersionError(
             "Pre-release base must look like <digits[.digits...]>, "
             f"got: {tag!r}"
         )
 
-    # Supported: -alpha.1/-a1, -beta.2/-b2, -rc.3/-rc3
-    # Also support: -dev.4, -post.5, -pre.6/-preview.6
-    m = re.fullmatch(
-        r"(?P<label>alpha|a|beta|b|rc|pre|preview|dev|post)\.?" r"(?P<num>\d+)",
-        suffix,
-        flags=re.IGNORECASE,
-    )
+    m = _SUFFIX_RE.fullmatch(suffix)
     if not m:
         raise VersionError(
             "Unsupported pre-release tag suffix. Use one of: "
@@ -56,95 +85,65 @@ def tag_to_pep440(tag: str) -> tuple[str, bool]:
             f"Got: {tag!r}"
         )
 
-    label = m.group("label").lower()
-    num = m.group("num")
+    label, num = m.groups()
+    return f"{base}{_LABEL_TO_PEP440[label.lower()]}{num}", True
+
+
+def _project_version(parsed: dict) -> str:
+    project = parsed.get("project")
+    version = project.get("version") if isinstance(project, dict) else None
+    if not isinstance(version, str):
+        raise VersionError(_MISSING_VERSION_MESSAGE)
+    return version
+
 
-    if label in {"alpha", "a"}:
-        return f"{base}a{num}", True
-    if label in {"beta", "b"}:
-        return f"{base}b{num}", True
-    if label == "rc":
-        return f"{base}rc{num}", True
-    if label in {"pre", "preview"}:
-        # Map generic "pre" to rc for PEP 440 compatibility.
-        return f"{base}rc{num}", True
-    if label == "dev":
-        return f"{base}.dev{num}", True
-    if label == "post":
-        # Note: post releases are not pre-releases, but tag naming used '-' so treat as special.
-        return f"{base}.post{num}", True
+def _load(pyproject_path: Path) -> tuple[str, dict, re.Match[str] | None]:
+    """读取并解析一次 pyproject.toml，返回 (原文, 解析结果, version 行匹配)"""
+    # 按字节读取以保留原始换行符，写回时不做换行转换
+    text = pyproject_path.read_bytes().decode("utf-8")
+    return text, tomllib.loads(text), _PROJECT_VERSION_RE.search(text)
 
-    raise VersionError(f"Unhandled label: {label!r}")
+
+def _write_version(
+    pyproject_path: Path, text: str, m: re.Match[str] | None, new_version: str
+) -> None:
+    if m is None:
+        raise VersionError(_MISSING_VERSION_MESSAGE)
+
+    # 直接替换引号内的版本号，其余内容原样保留
+    start, end = m.span("value")
+    new_text = text[:start] + new_version + text[end:]
+    pyproject_path.write_text(new_text, encoding="utf-8", newline="")
 
 
 def update_pyproject_version(pyproject_path: Path, new_version: str) -> bool:
-    text = pyproject_path.read_text(encoding="utf-8")
-    lines = text.splitlines(keepends=True)
-
-    in_project = False
-    for idx, line in enumerate(lines):
-        section_match = _SECTION_RE.match(line)
-        if section_match:
-            in_project = section_match.group("name").strip() == "project"
-            continue
-
-        if not in_project:
-            continue
-
-        # 移除行尾进行匹配，避免换行符影响正则匹配
-        line_without_ending = line.rstrip('\r\n')
-        m = _VERSION_LINE_RE.match(line_without_ending)
-        if not m:
-            continue
-
-        current = m.group("value")
-        if current == new_version:
-            return False
-
-        # 获取原始行尾（可能是 \n, \r\n 或空）
-        line_ending = line[len(line_without_ending):]
-        
-        # 重构行，保持原始格式和行尾
-        lines[idx] = f"{m.group('prefix')}\"{new_version}\"{m.group('suffix')}{line_ending}"
-        pyproject_path.write_text("".join(lines), encoding="utf-8")
-        return True
-
-    raise VersionError(
-        "Could not find [project].version in pyproject.toml. "
-        "Expected a line like: version = \"1.2.3\" under [project]."
-    )
+    text, parsed, m = _load(pyproject_path)
+    if _project_version(parsed) == new_version:
+        return False
+    _write_version(pyproject_path, text, m, new_version)
+    return True
 
 
 def read_pyproject_version(pyproject_path: Path) -> str:
-    text = pyproject_path.read_text(encoding="utf-8")
-    lines = text.splitlines()
-
-    in_project = False
-    for line in lines:
-        section_match = _SECTION_RE.match(line)
-        if section_match:
-            in_project = section_match.group("name").strip() == "project"
-            continue
-
-        if not in_project:
-            continue
-
-        m = _VERSION_LINE_RE.match(line)
-        if m:
-            return m.group("value")
-
-    raise VersionError(
-        "Could not find [project].version in pyproject.toml. "
-        "Expected a line like: version = \"1.2.3\" under [project]."
-    )
+    return _project_version(_load(pyproject_path)[1])
+
+
+_github_env_buffer: list[tuple[str, str]] = []
 
 
 def append_github_env(name: str, value: str) -> None:
-    env_path = os.environ.get("GITHUB_ENV")
-    if not env_path:
+    _github_env_buffer.append((name, value))
+
+
+def flush_github_env() -> None:
+    """把缓冲的变量一次性追加写入 $GITHUB_ENV"""
+    if not _github_env_buffer:
         return
-    with open(env_path, "a", encoding="utf-8", newline="\n") as f:
-        f.write(f"{name}={value}\n")
+    env_path = os.environ.get("GITHUB_ENV")
+    if env_path:
+        with open(env_path, "a", encoding="utf-8", newline="\n") as f:
+            f.write("".join(f"{name}={value}\n" for name, value in _github_env_buffer))
+    _github_env_buffer.clear()
 
 
 def main() -> int:
@@ -174,11 +173,12 @@ def main() -> int:
             append_github_env("PROJECT_VERSION", pep440_version)
             append_github_env("IS_PRERELEASE", "true" if is_prerelease else "false")
             append_github_env("CURRENT_PROJECT_VERSION", current)
+            flush_github_env()
 
         if current != pep440_version:
             print(
                 f"pyproject.toml version mismatch: current={current!r}, expected={pep440_version!r}",
-                file=os.sys.stderr,
+                file=sys.stderr,
             )
             return 2
 
@@ -191,6 +191,7 @@ def main() -> int:
         append_github_env("PROJECT_VERSION", pep440_version)
         append_github_env("IS_PRERELEASE", "true" if is_prerelease else "false")
         append_github_env("PYPROJECT_VERSION_CHANGED", "true" if changed else "false")
+        flush_github_env()
 
     print(pep440_version)
     return 0
@@ -1,7 +1,7 @@
 import sys
 import time
 import os
-from PyQt6.QtCore import QThread, Qt, pyqtSignal
+from PyQt6.QtCore import QThread, QTimer, Qt, pyqtSignal
 from PyQt6.QtGui import QIcon, QAction, QCursor
 from PyQt6.QtWidgets import (
     QApplication, QSystemTrayIcon, QMenu
@@ -11,19 +11,40 @@ from src.ui.input import InputWorker
 from src.ui.overlay import OverlayWidget
 from src.ui.map_overlay import MapOverlayWidget
 from src.ui.hp_overlay import HpOverlayWidget
-from src.ui.settings import SettingsWindow
+from src.ui.settings import SettingsWindow, load_overlay_appearance
 from src.updater import Updater
 from src.common import APP_FULLNAME, APP_VERSION, ICON_PATH
 from src.logger import info, warning, error
 
 
-def log_system_and_screen_info(app: QApplication):
-    try:
+# 退出时两个工作线程是否都在超时前正常结束
+_clean_exit = False
+
+
+_os_info: str | None = None
+
+def get_os_info() -> str:
+    """
+    获取操作系统描述，只计算一次。
+    Windows 下用 sys.getwindowsversion() 获取版本号，避免 platform.version() 的额外开销。
+    """
+    global _os_info
+    if _os_info is None:
         import platform
         system = platform.system()
         release = platform.release()
-        version = platform.version()
-        info(f"Operating System: {system} {release} ({version})")
+        if sys.platform == "win32":
+            winver = sys.getwindowsversion()
+            version = f"{winver.major}.{winver.minor}.{winver.build}"
+        else:
+            version = platform.version()
+        _os_info = f"{system} {release} ({version})"
+    return _os_info
+
+
+def log_system_and_screen_info(app: QApplication):
+    try:
+        info(f"Operating System: {get_os_info()}")
     except Exception as e:
         warning(f"Error getting OS info: {e}")
 
@@ -55,23 +76,22 @@ if __name__ == "__main__":
     info(f"Starting app v{APP_VERSION}...")
 
     QApplication.setAttribute(Qt.ApplicationAttribute.AA_Use96Dpi)
+    QApplication.setAttribute(Qt.ApplicationAttribute.AA_DontCreateNativeWidgetSiblings)
     QApplication.setHighDpiScaleFactorRoundingPolicy(Qt.HighDpiScaleFactorRoundingPolicy.PassThrough)
 
     app = QApplication(sys.argv)
 
-    log_system_and_screen_info(app)
-    
     # 防止因没有窗口而导致程序退出
     app.setQuitOnLastWindowClosed(False)
 
-    # 创建对象
+    # 创建对象（启动时只创建需要立即显示的主叠加层，其余对象在事件循环启动后创建）
     input = InputWorker()
     overlay = OverlayWidget()
-    map_overlay = MapOverlayWidget()
-    hp_overlay = HpOverlayWidget()
-
-    updater = Updater(input, overlay, map_overlay, hp_overlay)
-    settings_window = SettingsWindow(overlay, map_overlay, updater, input)
+    map_overlay: MapOverlayWidget | None = None
+    hp_overlay: HpOverlayWidget | None = None
+    updater: Updater | None = None
+    settings_window: SettingsWindow | None = None
+    updater_thread: QThread | None = None
     
     # 创建系统托盘图标和菜单
     tray_icon = QSystemTrayIcon()
@@ -81,6 +101,8 @@ if __name__ == "__main__":
     menu = QMenu()
     settings_action = QAction("设置")
     def show_settings():
+        if settings_window is None:
+            return
         settings_window.show()
         settings_window.activateWindow()
         settings_window.raise_()
@@ -97,15 +119,15 @@ if __name__ == "__main__":
         cursor_pos = QCursor.pos()
         menu.move(cursor_pos)
         menu.show()
+    def set_menu_opened(opened: bool):
+        for obj in (overlay, map_overlay, updater):
+            if obj is not None:
+                obj.is_menu_opened = opened
     def on_menu_show():
-        overlay.is_menu_opened = True
-        map_overlay.is_menu_opened = True
-        updater.is_menu_opened = True
+        set_menu_opened(True)
         # info("Menu opened")
     def on_menu_hide():
-        overlay.is_menu_opened = False
-        map_overlay.is_menu_opened = False
-        updater.is_menu_opened = False
+        set_menu_opened(False)
         # info("Menu closed")
 
     overlay.right_click_signal.connect(show_menu_at_cursor_pos)
@@ -118,38 +140,59 @@ if __name__ == "__main__":
     input.moveToThread(input_thread)
     input_thread.started.connect(input.run)
     input_thread.start()
-    
-    # 设置并启动后台检测器
-    updater_thread = QThread()
-    updater.moveToThread(updater_thread)
-    updater_thread.started.connect(updater.run)
-    updater_thread.start()
+
+    def init_deferred_objects():
+        global map_overlay, hp_overlay, updater, settings_window, updater_thread
+        map_overlay = MapOverlayWidget()
+        hp_overlay = HpOverlayWidget()
+
+        updater = Updater(input, overlay, map_overlay, hp_overlay)
+        settings_window = SettingsWindow(overlay, map_overlay, updater, input)
+
+        # 设置并启动后台检测器
+        updater_thread = QThread()
+        updater.moveToThread(updater_thread)
+        updater_thread.started.connect(updater.run)
+        updater_thread.start()
 
     # 清理：程序退出时，停止worker并等待线程结束
     def on_quit():
+        global _clean_exit
         info("Stopping worker thread...")
-        updater.stop()
-        updater_thread.quit()
-        if not updater_thread.wait(1000):
-            print("Updater thread did not exit in time. Forcing termination.")
-            updater_thread.terminate()
-        else:
-            info("Updater thread stopped.")
+        updater_stopped = True
+        if updater_thread is not None:
+            updater.stop()
+            updater_thread.quit()
+            updater_stopped = updater_thread.wait(1000)
+            if not updater_stopped:
+                print("Updater thread did not exit in time. Forcing termination.")
+                updater_thread.terminate()
+            else:
+                info("Updater thread stopped.")
         input.stop()
         input_thread.quit()
-        if not input_thread.wait(1000):
+        input_stopped = input_thread.wait(1000)
+        if not input_stopped:
             print("Input thread did not exit in time. Forcing termination.")
             input_thread.terminate()
         else:
             info("Input thread stopped.")
         info("All Thread stopped.")
+        _clean_exit = updater_stopped and input_stopped
 
         tray_icon.deleteLater()
 
     app.aboutToQuit.connect(on_quit)
     
+    # 设置窗口依赖延迟创建的对象，先单独恢复主叠加层保存的外观，避免首帧以默认大小和位置绘制
+    load_overlay_appearance(overlay)
     overlay.show()
 
+    # 其余叠加层、检测器和设置窗口在事件循环启动后再创建，让主叠加层先完成首帧绘制
+    QTimer.singleShot(0, init_deferred_objects)
+    # 系统和屏幕信息只用于日志，放到事件循环启动后再收集，不阻塞界面显示
+    QTimer.singleShot(0, lambda: log_system_and_screen_info(app))
+
     try:
         exit_code = app.exec() 
         info(f"QApp event loop finished with exit code {exit_code}.")
@@ -157,7 +200,12 @@ if __name__ == "__main__":
         exit_code = 1
         error(f"Exception in app exec: {e}")
 
-    settings_window.save_settings()
+    if settings_window is not None:
+        settings_window.save_settings()
+
+    # 线程都已正常结束时直接退出，让 Python 完成正常的清理流程
+    if _clean_exit:
+        sys.exit(exit_code)
 
     time.sleep(1)
     os._exit(exit_code)
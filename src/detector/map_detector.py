@@ -8,6 +8,8 @@ from mss.base import MSSBase
 from enum import Enum
 import random
 import gc
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from src.config import Config
 from src.logger import info, warning, error, debug
@@ -17,15 +19,20 @@ from src.detector.map_info import (
     STD_MAP_SIZE, 
     Position,
     MapPattern,
-    Construct,
 )
 from src.detector.utils import (
     paste_cv2,
     draw_icon,
     draw_text,
     grab_region,
-    match_template,
-    align_image,
+    to_premultiplied,
+    from_premultiplied,
+    resize_premultiplied,
+    alpha_composite_np,
+    get_template_pyramid,
+    match_template_pyramid,
+    estimate_align_matrix,
+    warp_by_align_matrix,
 )
 
 
@@ -53,6 +60,8 @@ def open_cv2_image(path: str, size: tuple[int, int] | None = None) -> np.ndarray
 
 
 CHECK_FULL_MAP_STD_SIZE = (100, 100)
+CHECK_FULL_MAP_CIRCLE_MIN_DIST = 20
+CHECK_FULL_MAP_CIRCLE_RADIUS_RANGE = (int(CHECK_FULL_MAP_STD_SIZE[1] * 0.4), int(CHECK_FULL_MAP_STD_SIZE[1] * 0.5))
 
 MATCH_EARTH_SHIFTING_SIZE = (100, 100)
 MATCH_EARTH_SHIFTING_REGION = (
@@ -63,6 +72,11 @@ MATCH_EARTH_SHIFTING_REGION = (
 )
 MATCH_EARTH_SHIFTING_OFFSET_AND_STRIDE = (5, 1)
 MATCH_EARTH_SHIFTING_SCALES = (0.95, 1.05, 7)
+MATCH_EARTH_SHIFTING_SCALE_LIST = tuple(np.linspace(*MATCH_EARTH_SHIFTING_SCALES, endpoint=True).tolist())
+
+ALIGN_CACHE_SIZE = 32
+POI_MATCH_WORKERS = max(2, (os.cpu_count() or 2) // 2)
+DEBUG_IMAGE_JPEG_QUALITY = 80
 
 MAP_BGS = { i : open_cv2_image(f"maps/{i}.jpg") for i in range(6) }
 MAG_BG_FOR_POI_MATCH_INDEX_MAP = {
@@ -91,6 +105,19 @@ POI_ICON_OFFSET = {
 POI_ICONS = { ctype: open_pil_image(f"icons/construct/{ctype}.png") for ctype in POI_ICON_SCALE.keys() }
 STD_POI_SIZE = (45, 45)
 
+MATCH_POI_DOWNSAMPLE_SIZE = (16, 16)
+MATCH_POI_OFFSET_AND_STRIDE = (4, 2)
+MATCH_POI_SCALES = (0.9, 1.1, 5)
+MATCH_POI_SCALE_LIST = tuple(np.linspace(*MATCH_POI_SCALES, endpoint=True).tolist())
+MATCH_POI_OFFSETS = tuple(
+    (dx, dy)
+    for dx in range(-MATCH_POI_OFFSET_AND_STRIDE[0], MATCH_POI_OFFSET_AND_STRIDE[0]+1, MATCH_POI_OFFSET_AND_STRIDE[1])
+    for dy in range(-MATCH_POI_OFFSET_AND_STRIDE[0], MATCH_POI_OFFSET_AND_STRIDE[0]+1, MATCH_POI_OFFSET_AND_STRIDE[1])
+)
+MATCH_SUBICON_DOWNSAMPLE_SIZE = (64, 64)
+MATCH_SUBICON_SCALES = (0.9, 1.1, 5)
+MATCH_SUBICON_SCALE_LIST = tuple(np.linspace(*MATCH_SUBICON_SCALES, endpoint=True).tolist())
+
 class Attribute(Enum):
     FIRE = 0
     MAGIC = 1
@@ -194,14 +221,51 @@ def match_prefix(ctype: int, prefix: list[int] | int) -> bool:
             x //= 10
     return False
 
-def has_same_base_icon(ctype1: int, ctype2: int) -> bool:
+def get_base_icon_class(ctype: int) -> int:
+    """
+    获取建筑类型的基础图标类别编号，编号相同的建筑使用相同的基础图标
+    （DLC建筑必须前三位完全相同才共用图标，其余建筑比较前两位）
+    """
+    return ctype // 100 if ctype // 10000 == 5 else ctype // 1000
+
+# 子图标类别编号，无子图标为 -1
+SUBICON_CLASS: dict[Attribute | Condition | None, int] = { k: i for i, k in enumerate(SUBICON_IMAGES) }
+SUBICON_CLASS[None] = -1
+
+def get_subicon_class(ctype: int) -> int:
+    return SUBICON_CLASS[CTYPE_SUBICON_MAP.get(ctype)]
+
+
+POI_SAMPLE_GRID_SIZE = (4, 4)
+POI_SAMPLE_SEED = 0
+
+def stratified_sample(positions: list[Position], sample_num: int) -> list[Position]:
+    """
+    按网格分层确定性地采样POI点，各网格按点数比例抽取，使采样点在地图上分布均匀
+    """
+    rng = random.Random(POI_SAMPLE_SEED)
+    gw, gh = POI_SAMPLE_GRID_SIZE
+    cells: dict[tuple[int, int], list[Position]] = defaultdict(list)
+    for pos in sorted(positions):
+        cells[(pos[0] * gw // STD_MAP_SIZE[0], pos[1] * gh // STD_MAP_SIZE[1])].append(pos)
+    keyed = []
+    for cell_positions in cells.values():
+        rng.shuffle(cell_positions)
+        n = len(cell_positions)
+        # 网格内第 i 个点的排序键为 (i+0.5)/n，取前 sample_num 个即按比例抽取
+        keyed.extend(((i + 0.5) / n, rng.random(), pos) for i, pos in enumerate(cell_positions))
+    keyed.sort()
+    return sorted(pos for _, _, pos in keyed[:sample_num])
+
+def write_debug_images(images: list[tuple[str, np.ndarray]]):
     """
-    判断两个建筑类型是否使用相同的基础图标
+    保存调试用的RGB图像，在后台线程中调用
     """
-    if ctype1 // 10000 == 5 or ctype2 // 10000 == 5:
-        return ctype1 // 100 == ctype2 // 100   # DLC建筑必须前三位完全相同才共用图标
-    else:
-        return ctype1 // 1000 == ctype2 // 1000
+    for path, img in images:
+        try:
+            cv2.imwrite(path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, DEBUG_IMAGE_JPEG_QUALITY])
+        except Exception as e:
+            warning(f"MapDetector: Save debug image {path} failed: {e}")
 
 
 @dataclass
@@ -213,11 +277,18 @@ class SubPoiInfo:
 class PoiCategoryInfo:
     base_image: Image.Image     # 不包含子图标的基础图像
     subtypes: dict[Attribute | Condition, SubPoiInfo]  # 子图标对应的图像和带子图标的POI类型
-    resized_images: dict[tuple[int, int], Image.Image] = field(default_factory=dict)
+    resized_images: dict[tuple[int, int], np.ndarray] = field(default_factory=dict)
 
-    def get_resized_image(self, size: tuple[int, int]) -> Image.Image:
+    def __post_init__(self):
+        self.base_array = to_premultiplied(self.base_image)
+
+    def get_resized_image(self, size: tuple[int, int]) -> np.ndarray:
+        """
+        返回缩放后的预乘alpha float32 数组
+        """
         if size not in self.resized_images:
-            self.resized_images[size] = self.base_image.resize(size, resample=PIL_RESAMPLE_METHOD)
+            # 可能在多个线程中同时生成，setdefault 保证都使用同一份结果
+            return self.resized_images.setdefault(size, resize_premultiplied(self.base_array, size))
         return self.resized_images[size]
 
 
@@ -293,6 +364,45 @@ class MapDetector:
                 image=self.all_poi_images[0],
             )},
         )
+        # 调试图绘制用的RGB图标
+        self.all_poi_images_rgb: dict[int, np.ndarray] = {
+            ctype: np.asarray(img)[..., :3].copy() for ctype, img in self.all_poi_images.items()
+        }
+
+        # 建筑类型查找表，避免匹配时逐个比较前缀和重复计算类别编号
+        # [ctype] -> 前缀匹配的POI大类别
+        self.ctype_poi_keys: dict[int, frozenset[int]] = {}
+        for ctypes in self.info.possible_poi_types.values():
+            for ctype in ctypes:
+                if ctype not in self.ctype_poi_keys:
+                    self.ctype_poi_keys[ctype] = frozenset(k for k in self.poi_cate_info if match_prefix(ctype, k))
+        # [ctype] -> (基础图标类别, 子图标类别)
+        self.ctype_classes: dict[int, tuple[int, int]] = {
+            ctype: (get_base_icon_class(ctype), get_subicon_class(ctype)) for ctype in self.all_poi_images
+        }
+
+        # 初始化地图模式的期望POI矩阵 [pattern_index, pos_index] -> 基础图标类别/子图标类别
+        self.pattern_pos_index: dict[Position, int] = {}
+        for pattern in self.info.patterns:
+            for pos in pattern.pos_constructions:
+                self.pattern_pos_index.setdefault(pos, len(self.pattern_pos_index))
+        pattern_num, pos_num = len(self.info.patterns), len(self.pattern_pos_index)
+        self.pattern_base_classes = np.full((pattern_num, pos_num), get_base_icon_class(0), dtype=np.int32)
+        self.pattern_subicon_classes = np.full((pattern_num, pos_num), get_subicon_class(0), dtype=np.int8)
+        for i, pattern in enumerate(self.info.patterns):
+            for pos, construct in pattern.pos_constructions.items():
+                expect_ctype = construct.type if construct.type in self.all_poi_images else 0
+                self.pattern_base_classes[i, self.pattern_pos_index[pos]] = get_base_icon_class(expect_ctype)
+                self.pattern_subicon_classes[i, self.pattern_pos_index[pos]] = get_subicon_class(expect_ctype)
+
+        # 地图模式索引 [earth_shifting, nightlord] -> 模式行号，nightlord 为 None 表示任意夜王
+        pattern_index: dict[tuple[int, int | None], list[int]] = defaultdict(list)
+        for i, pattern in enumerate(self.info.patterns):
+            pattern_index[(pattern.earth_shifting, pattern.nightlord)].append(i)
+            pattern_index[(pattern.earth_shifting, None)].append(i)
+        self.pattern_index: dict[tuple[int, int | None], np.ndarray] = {
+            k: np.array(v, dtype=np.int32) for k, v in pattern_index.items()
+        }
 
         # 初始化夜王图标
         nightlords = [(None, UNKNOWN_NIGHTLORD_ICON)]
@@ -314,6 +424,67 @@ class MapDetector:
             target_img = target_img.crop((int(w*0.3), int(h*0.3), int(w*0.7), int(h*0.7)))
             nightlords[i] = (nightlord, np.array(target_img)[..., :3])
         self.nightlord_icons: list[tuple[None | int, np.ndarray]] = nightlords
+        # 预先生成各缩放尺度的夜王模板，避免每次匹配时重复缩放
+        # 模板存为连续的 float32，matchTemplate 不必每次再转换类型
+        self.nightlord_icon_pyramids: list[tuple[None | int, list[tuple[float, np.ndarray]]]] = [
+            (nightlord, [
+                (scale, np.ascontiguousarray(template, dtype=np.float32))
+                for scale, template in get_template_pyramid(icon, MATCH_NIGHTLORD_SCALES)
+            ])
+            for nightlord, icon in nightlords
+        ]
+
+        # 预先生成各缩放尺度的子图标模板 [subicon] -> [(scale, template)]，存为连续的 float32
+        self.subicon_pyramids: dict[Attribute | Condition, list[tuple[float, np.ndarray]]] = {}
+        for subicon, subicon_img in SUBICON_IMAGES.items():
+            pyramid = []
+            for s in MATCH_SUBICON_SCALE_LIST:
+                size = (int(MATCH_SUBICON_DOWNSAMPLE_SIZE[0] * s * 0.3), int(MATCH_SUBICON_DOWNSAMPLE_SIZE[1] * s * 0.3))
+                target_img = subicon_img.resize(size, resample=Image.Resampling.NEAREST).convert("RGB")
+                target_img = np.array(target_img).astype(np.uint8)
+                target_img = cv2.GaussianBlur(target_img, (3, 3), 0)
+                th, tw = target_img.shape[0], target_img.shape[1]
+                target_img = target_img[int(th*0.1):int(th*0.9), int(tw*0.1):int(tw*0.9)]
+                pyramid.append((s, np.ascontiguousarray(target_img, dtype=np.float32)))
+            self.subicon_pyramids[subicon] = pyramid
+
+        # 特殊地形匹配用的各缩放尺度下的平移窗口 [map_id] -> [(2*offset+1)/stride, (2*offset+1)/stride, 3, h, w]
+        self.earth_shifting_windows: dict[int, list[np.ndarray]] = {}
+        x, y, w, h = MATCH_EARTH_SHIFTING_REGION
+        offset, stride = MATCH_EARTH_SHIFTING_OFFSET_AND_STRIDE
+        for map_id, map_img in MAP_BGS.items():
+            self.earth_shifting_windows[map_id] = []
+            for scale in MATCH_EARTH_SHIFTING_SCALE_LIST:
+                size = (int(MATCH_EARTH_SHIFTING_SIZE[0] * scale), int(MATCH_EARTH_SHIFTING_SIZE[1] * scale))
+                map_resized = cv2.resize(map_img, size, interpolation=CV2_RESIZE_METHOD).astype(np.int16)
+                windows = np.lib.stride_tricks.sliding_window_view(map_resized, (h, w), axis=(0, 1))
+                windows = windows[y-offset:y+offset+1:stride, x-offset:x+offset+1:stride]
+                self.earth_shifting_windows[map_id].append(windows)
+
+        # POI匹配用的地图背景 [earth_shifting] -> 缩放到标准尺寸的背景，相同背景共用同一数组
+        poi_match_bgs = {
+            bg_index: cv2.resize(open_cv2_image(f"maps_poi_match/{bg_index}.jpg"), STD_MAP_SIZE, interpolation=CV2_RESIZE_METHOD)
+            for bg_index in set(MAG_BG_FOR_POI_MATCH_INDEX_MAP.values())
+        }
+        self.poi_match_bgs: dict[int, np.ndarray] = {
+            es: poi_match_bgs[bg_index] for es, bg_index in MAG_BG_FOR_POI_MATCH_INDEX_MAP.items()
+        }
+
+        # 地图对齐变换矩阵缓存 [earth_shifting, 截图均值, 截图标准差] -> 2x3 仿射矩阵
+        self._align_cache: OrderedDict[tuple[int, int, int], np.ndarray] = OrderedDict()
+
+        # POI匹配候选图缓存 [earth_shifting, pos, poi_key] -> (N, H, W, 3) float32
+        self._poi_target_cache: dict[tuple[int, Position, int], np.ndarray] = {}
+
+        # POI采样点缓存 [earth_shifting, nightlord, sample_num] -> 采样点
+        self._poi_sample_cache: dict[tuple[int, int | None, int], list[Position]] = {}
+
+        # 各POI点的匹配互不依赖，且主要耗时在释放GIL的 NumPy/OpenCV 调用中，使用线程池并行
+        self._poi_pool = ThreadPoolExecutor(max_workers=POI_MATCH_WORKERS, thread_name_prefix="MapDetectorPoi")
+
+        # 调试图在单独线程中写入，不阻塞识别
+        self._debug_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="MapDetectorDebugIO")
+        self._debug_io_future: Future | None = None
             
         
     def _match_full_map(self, img: np.ndarray) -> float:
@@ -321,23 +492,24 @@ class MapDetector:
         img = img[-int(img.shape[0]*0.22):, :int(img.shape[1]*0.22)]
         img = cv2.resize(img, CHECK_FULL_MAP_STD_SIZE, interpolation=CV2_RESIZE_METHOD)
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        circles = []
+        # 只使用第一个检测到圆的阈值的结果，检测到后无需再尝试后续阈值
+        circles = None
         for thres in config.full_map_hough_circle_thres:
-            res = cv2.HoughCircles(
+            circles = cv2.HoughCircles(
                 gray, 
                 cv2.HOUGH_GRADIENT, 
                 dp=1, 
-                minDist=20,
+                minDist=CHECK_FULL_MAP_CIRCLE_MIN_DIST,
                 param1=thres,
                 param2=30, 
-                minRadius=int(img.shape[0] * 0.4), 
-                maxRadius=int(img.shape[0] * 0.5)
+                minRadius=CHECK_FULL_MAP_CIRCLE_RADIUS_RANGE[0], 
+                maxRadius=CHECK_FULL_MAP_CIRCLE_RADIUS_RANGE[1],
             )
-            if res is not None:
-                circles.extend(res)
+            if circles is not None:
+                break
         error = float('inf')
-        if circles:
-            cx, cy, cr = sorted(list(circles[0]), key=lambda x: x[2], reverse=True)[0]
+        if circles is not None:
+            cx, cy, cr = max(circles[0], key=lambda x: x[2])
             # cv2.circle(img, (int(cx), int(cy)), int(cr), (0, 255, 0), 2)
             # cv2.circle(img, (int(cx), int(cy)), 2, (0, 0, 255), 3)
             # cv2.imwrite("sandbox/full_map_test.jpg", cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
@@ -349,23 +521,23 @@ class MapDetector:
         t = time.time()
         img = cv2.resize(img, MATCH_EARTH_SHIFTING_SIZE, interpolation=CV2_RESIZE_METHOD)
         x, y, w, h = MATCH_EARTH_SHIFTING_REGION
-        img = img[y:y+h, x:x+w].astype(int)
+        # 转为 (3, h, w) 以便与平移窗口广播
+        img = img[y:y+h, x:x+w].astype(np.int16).transpose(2, 0, 1)
+        # sqrt 单调，中位数只需对平方和做部分排序后再对中间两个值开方
+        n = h * w
+        kth = ((n - 1) // 2, n // 2)
         best_map_id, best_score = None, float('inf')
-        offset, stride = MATCH_EARTH_SHIFTING_OFFSET_AND_STRIDE
-        min_scale, max_scale, scale_num = MATCH_EARTH_SHIFTING_SCALES
-        for map_id, map_img in MAP_BGS.items():
+        for map_id, windows_list in self.earth_shifting_windows.items():
             score = float('inf')
-            for scale in np.linspace(min_scale, max_scale, scale_num, endpoint=True):
-                size = (int(MATCH_EARTH_SHIFTING_SIZE[0] * scale), int(MATCH_EARTH_SHIFTING_SIZE[1] * scale))
-                map_resized = cv2.resize(map_img, size, interpolation=CV2_RESIZE_METHOD).astype(int)
-                for dx in range(-offset, offset+1, stride):
-                    for dy in range(-offset, offset+1, stride):
-                        map_shifted = map_resized[y+dy:y+h+dy, x+dx:x+w+dx]
-                        diff = np.abs((img - map_shifted))
-                        diff[diff > 100] = 0
-                        diff = np.linalg.norm(diff, axis=2)
-                        cur_score = np.median(diff)
-                        score = min(score, cur_score)
+            for windows in windows_list:
+                # 一次性计算该尺度下所有平移的差异
+                diff = np.abs(windows - img)
+                diff[diff > 100] = 0
+                diff *= diff    # 不超过 3*100^2，int16 不会溢出
+                diff = (diff[:, :, 0] + diff[:, :, 1] + diff[:, :, 2]).reshape(-1, n)
+                mid = np.partition(diff, kth, axis=1)[:, kth]
+                cur_scores = np.sqrt(mid, dtype=np.float64).mean(axis=1)
+                score = min(score, cur_scores.min())
             # print(f"map {map_id} score: {score:.4f}")
             if score < best_score:
                 best_score = score
@@ -377,16 +549,12 @@ class MapDetector:
         t = time.time()
         img = cv2.resize(img, MATCH_NIGHTLORD_SIZE, interpolation=CV2_RESIZE_METHOD)
         h, w = img.shape[0], img.shape[1]
-        img = img[-int(h*0.15):-int(h*0.05), int(w*0.06):int(w*0.16)]
+        img = img[-int(h*0.15):-int(h*0.05), int(w*0.06):int(w*0.16)].astype(np.float32)
 
         best_nightlord, best_score = None, float('inf')
         
-        for nightlord, icon in self.nightlord_icons:
-            match_result, score = match_template(
-                img, 
-                icon, 
-                MATCH_NIGHTLORD_SCALES
-            )
+        for nightlord, pyramid in self.nightlord_icon_pyramids:
+            match_result, score = match_template_pyramid(img, pyramid)
             # print(f"nightlord {nightlord} score: {score:.4f}")
             if score < best_score:
                 best_score = score
@@ -400,16 +568,16 @@ class MapDetector:
         poi_key = construct_type // 100 if construct_type // 100 in POI_ICONS else construct_type // 1000
         offset_x, offset_y = POI_ICON_OFFSET.get(poi_key, (0, 0))
         x, y = STD_POI_SIZE[0] // 2, STD_POI_SIZE[1] // 2
-        img = Image.new("RGBA", STD_POI_SIZE, (0, 0, 0, 0))
+        img = np.zeros((STD_POI_SIZE[1], STD_POI_SIZE[0], 4), dtype=np.float32)
         if construct_type:
             icon, icon_scale = POI_ICONS[poi_key], POI_ICON_SCALE[poi_key]
             icon_size = (
                 int(icon.size[0] * icon_scale * STD_MAP_SIZE[0] / 750),
                 int(icon.size[1] * icon_scale * STD_MAP_SIZE[1] / 750),
             )
-            icon = icon.resize(icon_size, resample=PIL_RESAMPLE_METHOD)
+            icon = resize_premultiplied(to_premultiplied(icon), icon_size)
             icon_pos = (x - icon_size[0] // 2 + offset_x, y - icon_size[1] // 2 + offset_y)
-            img.alpha_composite(icon, icon_pos)
+            alpha_composite_np(img, icon, icon_pos)
             if with_subicon and construct_type in CTYPE_SUBICON_MAP:
                 subicon = CTYPE_SUBICON_MAP[construct_type]
                 subicon = SUBICON_IMAGES.get(subicon)
@@ -417,19 +585,37 @@ class MapDetector:
                     int(STD_MAP_SIZE[0] * 0.0195), 
                     int(STD_MAP_SIZE[1] * 0.0195),
                 )
-                subicon = subicon.resize(subicon_size, resample=PIL_RESAMPLE_METHOD)
+                subicon = resize_premultiplied(to_premultiplied(subicon), subicon_size)
                 subicon_pos = (
                     int(x - subicon_size[0] / 2 + STD_MAP_SIZE[0] * 0.013),
                     int(y + subicon_size[1] / 2 + STD_MAP_SIZE[1] * -0.007),
                 )
-                img.alpha_composite(subicon, subicon_pos)
-        return img
+                alpha_composite_np(img, subicon, subicon_pos)
+        return from_premultiplied(img)
+
+    def _make_poi_targets(self, bg: np.ndarray, info: PoiCategoryInfo, crop: tuple[int, int, int, int]) -> np.ndarray:
+        """
+        生成某个位置上某类POI在各偏移和缩放下的候选图，返回 (N, H, W, 3) float32
+        """
+        h_min, h_max, w_min, w_max = crop
+        target_imgs = []
+        for dx, dy in MATCH_POI_OFFSETS:
+            for s in MATCH_POI_SCALE_LIST:
+                size = (int(STD_POI_SIZE[0] * s), int(STD_POI_SIZE[1] * s))
+                resized_poi_icon = info.get_resized_image(size)
+                poi_img = bg.copy()
+                alpha_composite_np(poi_img, resized_poi_icon, (dx, dy))
+                poi_img = cv2.resize(poi_img, MATCH_POI_DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
+                poi_img = poi_img[h_min:h_max, w_min:w_max]
+                target_imgs.append(poi_img)
+        return np.array(target_imgs, dtype=np.float32)
 
     def _match_poi(self, map_img: np.ndarray, map_bg: np.ndarray, pos: Position, earth_shifting: int, nightlord: int | None = None) -> tuple[int, float]:
-        img = map_img[
+        # 截图区域会被缩放两次，先复制为连续数组；背景仅在生成候选图时使用，保持视图即可
+        img = np.ascontiguousarray(map_img[
             pos[1]-STD_POI_SIZE[1]//2:pos[1]-STD_POI_SIZE[1]//2+STD_POI_SIZE[1],
             pos[0]-STD_POI_SIZE[0]//2:pos[0]-STD_POI_SIZE[1]//2+STD_POI_SIZE[0],
-        ]
+        ])
         bg = map_bg[
             pos[1]-STD_POI_SIZE[1]//2:pos[1]-STD_POI_SIZE[1]//2+STD_POI_SIZE[1],
             pos[0]-STD_POI_SIZE[0]//2:pos[0]-STD_POI_SIZE[1]//2+STD_POI_SIZE[0],
@@ -437,47 +623,38 @@ class MapDetector:
         
 
         # 判断建筑类型
-        DOWNSAMPLE_SIZE = (16, 16)
-        MAX_OFFSET = 4
-        OFFSET_STRIDE = 2
-        SCALE_RANGE = (0.9, 1.1, 5)
-
-        img_for_poi = cv2.resize(img, DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
+        img_for_poi = cv2.resize(img, MATCH_POI_DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
         h, w, _ = img_for_poi.shape
-        h_min, h_max, w_min, w_max = int(h*0.2), int(h*0.8), int(w*0.2), int(w*0.6)
-        img_for_poi = img_for_poi[h_min:h_max, w_min:w_max]
-        bg = Image.fromarray(bg).convert("RGBA")
+        crop = (int(h*0.2), int(h*0.8), int(w*0.2), int(w*0.6))
+        img_for_poi = img_for_poi[crop[0]:crop[1], crop[2]:crop[3]].astype(np.float32)
+        bg_float = None
 
         best_poi_key = None
         best_poi_key_score = float('inf')
 
         # 收集该位置可能出现的POI类型
         nightlords = [nightlord] if nightlord is not None else self.info.all_nightlords
-        possible_ctypes = set()
+        possible_poi_keys = set()
         for nl in nightlords:
-            possible_ctypes.update(self.info.possible_poi_types.get((earth_shifting, nl, pos), set()))
+            for ctype in self.info.possible_poi_types.get((earth_shifting, nl, pos), ()):
+                possible_poi_keys |= self.ctype_poi_keys[ctype]
 
-        # print("pos:", pos, "possible ctypes:", possible_ctypes)
+        # print("pos:", pos, "possible poi keys:", possible_poi_keys)
         for poi_key, info in self.poi_cate_info.items():
             t = time.time()
-            if not any(match_prefix(ctype, poi_key) for ctype in possible_ctypes):
+            if poi_key not in possible_poi_keys:
                 continue    # 仅匹配该位置可能出现的POI类型
-            
-            target_imgs = []
-            for dx in range(-MAX_OFFSET, MAX_OFFSET+1, OFFSET_STRIDE):
-                for dy in range(-MAX_OFFSET, MAX_OFFSET+1, OFFSET_STRIDE):
-                    for s in np.linspace(SCALE_RANGE[0], SCALE_RANGE[1], SCALE_RANGE[2], endpoint=True):
-                        size = (int(STD_POI_SIZE[0] * s), int(STD_POI_SIZE[1] * s))
-                        resized_poi_icon = info.get_resized_image(size)
-                        poi_img = bg.copy()
-                        poi_img.alpha_composite(resized_poi_icon, (dx, dy))
-                        poi_img = np.array(poi_img)[..., :3]
-                        poi_img = cv2.resize(poi_img, DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
-                        poi_img = poi_img[h_min:h_max, w_min:w_max]
-                        target_imgs.append(poi_img)
-
-            target_imgs = np.array(target_imgs).astype(np.float32)
-            diffs = np.mean((target_imgs - img_for_poi.astype(np.float32)) ** 2, axis=(1, 2, 3))
+
+            # 候选图只与地图背景、位置和POI类别有关，首次使用时生成并缓存
+            cache_key = (earth_shifting, pos, poi_key)
+            target_imgs = self._poi_target_cache.get(cache_key)
+            if target_imgs is None:
+                if bg_float is None:
+                    bg_float = bg.astype(np.float32)
+                target_imgs = self._make_poi_targets(bg_float, info, crop)
+                target_imgs = self._poi_target_cache.setdefault(cache_key, target_imgs)
+
+            diffs = np.mean((target_imgs - img_for_poi) ** 2, axis=(1, 2, 3))
             min_idx = np.argmin(diffs)
             poi_key_score = diffs[min_idx]
             if poi_key_score < best_poi_key_score:
@@ -485,7 +662,7 @@ class MapDetector:
                 best_poi_key = poi_key
 
             # best_img = target_imgs[min_idx].astype(np.uint8)
-            # vis = np.concatenate([img_for_poi, best_img], axis=1)
+            # vis = np.concatenate([img_for_poi.astype(np.uint8), best_img], axis=1)
             # display_cv2_image(vis, None)
             # if pos == (270, 615):
             #     cv2.imwrite(f"sandbox/debug/{poi_key}.jpg", cv2.cvtColor(vis, cv2.COLOR_RGB2BGR))
@@ -494,13 +671,10 @@ class MapDetector:
         # print(f"Best {pos} poi category:", best_poi_key, "score:", best_poi_key_score)
 
         # 判断子图标类型
-        DOWNSAMPLE_SIZE = (64, 64)
-        SCALE_RANGE = (0.9, 1.1, 5)
-
-        img_for_subicon = cv2.resize(img, DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
+        img_for_subicon = cv2.resize(img, MATCH_SUBICON_DOWNSAMPLE_SIZE, interpolation=CV2_RESIZE_METHOD)
         h, w, _ = img_for_subicon.shape
         img_for_subicon = img_for_subicon[int(h*0.4):, int(w*0.4):]
-        img_for_subicon = cv2.GaussianBlur(img_for_subicon, (3, 3), 0)
+        img_for_subicon = cv2.GaussianBlur(img_for_subicon, (3, 3), 0).astype(np.float32)
 
         best_subicon = None
         best_subicon_score = float('inf')
@@ -509,28 +683,11 @@ class MapDetector:
             if not subicon:
                 continue
             t = time.time()
-            subicon_img = SUBICON_IMAGES[subicon]
-            for s in np.linspace(SCALE_RANGE[0], SCALE_RANGE[1], SCALE_RANGE[2], endpoint=True):
-                size = (int(DOWNSAMPLE_SIZE[0] * s * 0.3), int(DOWNSAMPLE_SIZE[1] * s * 0.3))
-                target_img = subicon_img.resize(size, resample=Image.Resampling.NEAREST).convert("RGB")
-                target_img = np.array(target_img).astype(np.uint8)
-                target_img = cv2.GaussianBlur(target_img, (3, 3), 0)
-                th, tw = target_img.shape[0], target_img.shape[1]
-                target_img = target_img[int(th*0.1):int(th*0.9), int(tw*0.1):int(tw*0.9)]
-                match_result, match_val = match_template(
-                    img_for_subicon,
-                    target_img,
-                    scales=(1.0, 1.0, 1)
-                )
-                if match_val < best_subicon_score:
-                    best_subicon_score = match_val
-                    best_subicon = subicon
-                
-                # if abs(1.0 - s) < 1e-3:
-                #     vis = img_for_subicon.copy()
-                #     vis[:size[0], :size[1], :] = target_img
-                #     display_cv2_image(vis, None)
-                # print(f"subicon {subicon} {s:.2f}x match score: {match_val:.4f}, time cost: {time.time() - t:.4f}s")
+            match_result, match_val = match_template_pyramid(img_for_subicon, self.subicon_pyramids[subicon])
+            if match_val < best_subicon_score:
+                best_subicon_score = match_val
+                best_subicon = subicon
+            # print(f"subicon {subicon} match score: {match_val:.4f}, time cost: {time.time() - t:.4f}s")
 
         if None in self.poi_cate_info[best_poi_key].subtypes:
             if best_subicon_score > Config.get().subicon_template_match_threshold:
@@ -541,6 +698,22 @@ class MapDetector:
         best_ctype = sorted(list(self.poi_cate_info[best_poi_key].subtypes.get(best_subicon).ctypes))[0]
         return best_ctype, best_poi_key_score * best_subicon_score
 
+    def _align_map_image(self, img: np.ndarray, map_bg: np.ndarray, earth_shifting: int, region: tuple[int, int, int, int]) -> np.ndarray:
+        """
+        将地图截图对齐到POI匹配背景，画面没有变化时复用上次估计的变换矩阵
+        """
+        sample = img[::16, ::16, 0]
+        key = (earth_shifting, int(sample.mean() * 100), int(sample.std() * 100))
+        matrix = self._align_cache.get(key)
+        if matrix is None:
+            matrix = estimate_align_matrix(img, map_bg, region)
+            self._align_cache[key] = matrix
+            if len(self._align_cache) > ALIGN_CACHE_SIZE:
+                self._align_cache.popitem(last=False)
+        else:
+            self._align_cache.move_to_end(key)
+        return warp_by_align_matrix(img, matrix, map_bg.shape)
+
     def _match_map_pattern(self, img: np.ndarray, earth_shifting: int, topk: int) -> list[MapPatternMatchResult]:
         assert earth_shifting is not None, "earth_shifing should be provided when matching map pattern"
 
@@ -551,8 +724,7 @@ class MapDetector:
         nightlord, _ = self._match_nightlord(img)
 
         # 校准偏移
-        map_bg = open_cv2_image(f"maps_poi_match/{MAG_BG_FOR_POI_MATCH_INDEX_MAP[earth_shifting]}.jpg")
-        map_bg = cv2.resize(map_bg, STD_MAP_SIZE, interpolation=CV2_RESIZE_METHOD)
+        map_bg = self.poi_match_bgs[earth_shifting]
         try:
             align_t = time.time()
             ALIGN_REGION = (
@@ -561,7 +733,7 @@ class MapDetector:
                 int(STD_MAP_SIZE[0] * 0.6),
                 int(STD_MAP_SIZE[1] * 0.6),
             )
-            img = align_image(img, map_bg, ALIGN_REGION)
+            img = self._align_map_image(img, map_bg, earth_shifting, ALIGN_REGION)
             info(f"MapDetector: Align map image time cost: {time.time() - align_t:.4f}s")
         except Exception as e:
             warning(f"MapDetector: Align map image failed: {e}")
@@ -577,67 +749,54 @@ class MapDetector:
 
         ratio = Config.get().poi_match_sample_ratio_w_nightlord if nightlord is not None else Config.get().poi_match_sample_ratio_wo_nightlord
         sample_num = max(8, int(len(all_poi_pos) * ratio))  # 最少采样8个POI点
-        all_poi_pos = list(all_poi_pos)
-        random.shuffle(all_poi_pos)
-
-        for x, y in sorted(all_poi_pos[:sample_num]):
-            ctype, score = self._match_poi(img, map_bg, (x, y), earth_shifting, nightlord)
+        # 固定采样点，使各帧命中相同的POI候选图缓存
+        sample_key = (earth_shifting, nightlord, sample_num)
+        if sample_key not in self._poi_sample_cache:
+            self._poi_sample_cache[sample_key] = stratified_sample(list(all_poi_pos), sample_num)
+
+        sampled_pos = self._poi_sample_cache[sample_key]
+        futures = [self._poi_pool.submit(self._match_poi, img, map_bg, pos, earth_shifting, nightlord) for pos in sampled_pos]
+        for (x, y), future in zip(sampled_pos, futures):
+            ctype, score = future.result()
             poi_result[(x, y)] = ctype
 
             # 绘制调试图
-            paste_cv2(poi_result_img, np.array(self.all_poi_images[ctype])[..., :3], (x-STD_POI_SIZE[0]//2, y-STD_POI_SIZE[1]//2))
+            paste_cv2(poi_result_img, self.all_poi_images_rgb[ctype], (x-STD_POI_SIZE[0]//2, y-STD_POI_SIZE[1]//2))
             cv2.circle(poi_result_img, (x, y), 2, (255, 0, 0), 3)
 
-        # 保存结果用于调试
-        cv2.imwrite(get_appdata_path(f"map.jpg"), cv2.cvtColor(img, cv2.COLOR_RGB2BGR))
-        cv2.imwrite(get_appdata_path(f"map_poi_result.jpg"), cv2.cvtColor(poi_result_img, cv2.COLOR_RGB2BGR))
+        # 保存结果用于调试，上一次还未写完时跳过本次
+        if self._debug_io_future is None or self._debug_io_future.done():
+            self._debug_io_future = self._debug_io.submit(write_debug_images, [
+                (get_appdata_path("map.jpg"), img.copy()),
+                (get_appdata_path("map_poi_result.jpg"), poi_result_img),
+            ])
 
         # 匹配地图模式
-        EMPTY_CONSTRUCTION = Construct(type=0, pos=0, is_display=False)
-        results: list[MapPatternMatchResult] = []
-        for pattern in self.info.patterns:
-            if pattern.earth_shifting != earth_shifting:
-                continue
-            if nightlord is not None and pattern.nightlord != nightlord:
-                continue
-            score, error = 0, 0
-            for pos, ctype in poi_result.items():
-                expect_ctype = pattern.pos_constructions.get(pos, EMPTY_CONSTRUCTION).type
-                if expect_ctype not in self.all_poi_images:
-                    expect_ctype = 0
+        candidates = self.pattern_index.get((earth_shifting, nightlord), np.empty(0, dtype=np.int32))
 
-                subicon = CTYPE_SUBICON_MAP.get(ctype)
-                expect_subicon = CTYPE_SUBICON_MAP.get(expect_ctype)
-
-                if not has_same_base_icon(ctype, expect_ctype):   # 建筑类型不符合
-                    if subicon == expect_subicon:
-                        score += 1      # 子图标符合
-                        error += 3
-                    else:
-                        score += 0
-                        error += 10
-                else:
-                    if subicon == expect_subicon:
-                        score += 10     # 完全符合 
-                        error += 0
-                    elif subicon or expect_subicon:
-                        score += 0  # 一个有子图标一个没有
-                        error += 10
-                    else:
-                        score += 3      # 子图标不符合
-                        error += 1
-
-            # info(f"pattern {pattern.id} match score: {score} error: {error}")
-            results.append(MapPatternMatchResult(
-                pattern=pattern,
-                nightlord=nightlord,
-                score=score,
-                error=error,
-            ))
+        pos_indices = np.array([self.pattern_pos_index[pos] for pos in poi_result], dtype=np.intp)
+        obs_classes = [self.ctype_classes[ctype] for ctype in poi_result.values()]
+        obs_base = np.array([c[0] for c in obs_classes], dtype=np.int32)
+        obs_sub = np.array([c[1] for c in obs_classes], dtype=np.int8)
+        same_base = self.pattern_base_classes[np.ix_(candidates, pos_indices)] == obs_base
+        same_sub = self.pattern_subicon_classes[np.ix_(candidates, pos_indices)] == obs_sub
+
+        # 完全符合: +10分；仅建筑类型符合（子图标不符合或一个有子图标一个没有）: +10误差
+        # 仅子图标符合: +1分 +3误差；都不符合: +10误差
+        scores = np.where(same_base, np.where(same_sub, 10, 0), np.where(same_sub, 1, 0)).sum(axis=1)
+        errors = np.where(same_base, np.where(same_sub, 0, 10), np.where(same_sub, 3, 10)).sum(axis=1)
 
         # 使用Error最小的结果
-        results = sorted(results, key=lambda x: (x.error, -x.score))
-        best_patterns_by_error = results[:topk]
+        order = np.lexsort((-scores, errors))[:topk]
+        best_patterns_by_error = [
+            MapPatternMatchResult(
+                pattern=self.info.patterns[candidates[i]],
+                nightlord=nightlord,
+                score=int(scores[i]),
+                error=int(errors[i]),
+            )
+            for i in order
+        ]
         info(f"Match map pattern: return {[p.pattern.id for p in best_patterns_by_error]}, time cost: {time.time() - t:.4f}s")
         return best_patterns_by_error
 
@@ -908,7 +1067,14 @@ class MapDetector:
 
         # 地图模式匹配
         if param.do_match_pattern:
-            results = self._match_map_pattern(img, param.earth_shifting, topk=param.return_pattern_topk)
+            # 匹配过程中会产生大量小对象，暂停自动GC避免中途停顿，结束后统一回收
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                results = self._match_map_pattern(img, param.earth_shifting, topk=param.return_pattern_topk)
+            finally:
+                if gc_enabled:
+                    gc.enable()
 
             # 决定信息绘制大小
             if config.fixed_map_overlay_draw_size is not None:
@@ -929,9 +1095,9 @@ class MapDetector:
                     overlay_img = self._draw_overlay_image(result, draw_size, i)
                     ret.overlay_images.append(overlay_img)
                     ret.patterns.append(result.pattern)
-                    gc.collect()
                 except Exception as e:
                     error(f"MapDetector: Draw overlay image of pattern {result.pattern.id} failed: {e}")
+            gc.collect()
 
         return ret
 
@@ -97,6 +97,48 @@ def paste_cv2(img1: np.ndarray, img2: np.ndarray, pos: tuple[int, int]):
     h, w = img2.shape[0], img2.shape[1]
     img1[y:y+h, x:x+w] = img2
 
+def to_premultiplied(img: Image.Image) -> np.ndarray:
+    """
+    RGBA图像转为预乘alpha的 float32 数组，缩放时透明像素的颜色不会渗到边缘
+    """
+    arr = np.asarray(img.convert("RGBA"), dtype=np.float32).copy()
+    arr[..., :3] *= arr[..., 3:] / 255
+    return arr
+
+def from_premultiplied(arr: np.ndarray) -> Image.Image:
+    alpha = arr[..., 3:]
+    rgb = np.divide(arr[..., :3] * 255, alpha, out=np.zeros_like(arr[..., :3]), where=alpha > 0)
+    arr = np.concatenate([rgb, alpha], axis=2)
+    return Image.fromarray(np.clip(np.rint(arr), 0, 255).astype(np.uint8), "RGBA")
+
+def resize_premultiplied(arr: np.ndarray, size: tuple[int, int]) -> np.ndarray:
+    """
+    缩放预乘alpha数组，缩小用 INTER_AREA，放大用 INTER_CUBIC
+    """
+    h, w = arr.shape[:2]
+    interpolation = cv2.INTER_AREA if size[0] <= w and size[1] <= h else cv2.INTER_CUBIC
+    arr = cv2.resize(arr, size, interpolation=interpolation)
+    # 三次插值可能过冲，限制在合法范围内
+    np.clip(arr, 0, 255, out=arr)
+    np.minimum(arr[..., :3], arr[..., 3:], out=arr[..., :3])
+    return arr
+
+def alpha_composite_np(dst: np.ndarray, src: np.ndarray, pos: tuple[int, int]):
+    """
+    将预乘alpha的 src 原地混合到 dst 的 pos 位置，超出 dst 的部分被裁剪
+    dst 为不透明的 RGB 或预乘alpha的 RGBA float32 数组
+    """
+    x, y = pos
+    h, w = src.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, dst.shape[1]), min(y + h, dst.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    src = src[y0-y:y1-y, x0-x:x1-x]
+    region = dst[y0:y1, x0:x1]
+    region *= 1 - src[..., 3:] / 255
+    region += src[..., :region.shape[2]]
+
 def grab_region(sct: MSSBase, region: tuple[int], processing: str = 'none') -> Image.Image:
     """
     截取屏幕区域并可选地进行图像处理
@@ -243,15 +285,37 @@ def match_template(
     scales: tuple[float, float, int], 
     mask: np.ndarray=None
 ) -> tuple[tuple[int, int, int, float] | None, float]:
-    best_match = None
-    best_val = float('inf')
+    return match_template_pyramid(image, get_template_pyramid(template, scales), mask)
+
+
+def get_template_pyramid(template: np.ndarray, scales: tuple[float, float, int]) -> list[tuple[float, np.ndarray]]:
+    """
+    预先生成模板在各缩放尺度下的图像，供 match_template_pyramid 重复使用
+    """
+    pyramid = []
     for scale in np.linspace(scales[0], scales[1], num=scales[2], endpoint=True):
         resized_template = cv2.resize(template, (int(template.shape[1] * scale), int(template.shape[0] * scale)))
+        pyramid.append((scale, resized_template))
+    return pyramid
+
+
+def match_template_pyramid(
+    image: np.ndarray, 
+    pyramid: list[tuple[float, np.ndarray]],
+    mask: np.ndarray=None,
+) -> tuple[tuple[int, int, int, float] | None, float]:
+    """
+    使用 get_template_pyramid 预先缩放好的模板进行多尺度匹配，mask 会缩放到各尺度模板的大小
+    """
+    best_match = None
+    best_val = float('inf')
+    for scale, resized_template in pyramid:
         if resized_template.shape[0] > image.shape[0] or resized_template.shape[1] > image.shape[1]:
             continue
+        resized_mask = None
         if mask is not None:
-            mask = cv2.resize(mask, (resized_template.shape[1], resized_template.shape[0]))
-        result = cv2.matchTemplate(image, resized_template, cv2.TM_SQDIFF_NORMED, mask)
+            resized_mask = cv2.resize(mask, (resized_template.shape[1], resized_template.shape[0]))
+        result = cv2.matchTemplate(image, resized_template, cv2.TM_SQDIFF_NORMED, mask=resized_mask)
         min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
         if min_val < best_val:
             best_val = min_val
@@ -259,10 +323,10 @@ def match_template(
     return best_match, best_val
 
 
-def align_image(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int, int]) -> np.ndarray:
+def estimate_align_matrix(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int, int]) -> np.ndarray:
     """
-    使用 SIFT 特征点匹配对齐两张图像。
-    仅使用 region 区域内的图像进行特征点检测和匹配，返回对齐后的整张图像。
+    使用 SIFT 特征点匹配估计将 img 对齐到 target 的仿射变换矩阵。
+    仅使用 region 区域内的图像进行特征点检测和匹配。
     
     Args:
         img: 待变换的图像 (图A)
@@ -270,7 +334,7 @@ def align_image(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int
         region: (x, y, w, h) 指定用于匹配的区域坐标
         
     Returns:
-        np.ndarray: 对齐后的图像，大小与 target 一致
+        np.ndarray: 2x3 仿射变换矩阵
     """
     x, y, w, h = region
     
@@ -285,7 +349,7 @@ def align_image(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int
     kp_target, des_target = sift.detectAndCompute(gray_target, None)
 
     if des_img is None or des_target is None:
-        raise ValueError("align_image: No features found in region.")
+        raise ValueError("estimate_align_matrix: No features found in region.")
 
     index_params = dict(algorithm=1, trees=5) # FLANN_INDEX_KDTREE = 1
     search_params = dict(checks=50)
@@ -297,7 +361,7 @@ def align_image(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int
             good_matches.append(m)
 
     if len(good_matches) < 4:
-        raise ValueError(f"align_image: Not enough matches found ({len(good_matches)}).")
+        raise ValueError(f"estimate_align_matrix: Not enough matches found ({len(good_matches)}).")
 
     src_pts = np.float32([kp_img[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
     dst_pts = np.float32([kp_target[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
@@ -309,17 +373,22 @@ def align_image(img: np.ndarray, target: np.ndarray, region: tuple[int, int, int
 
     matrix, mask = cv2.estimateAffinePartial2D(src_pts, dst_pts, method=cv2.RANSAC)
 
-    if matrix is not None:
-        h_target, w_target = target.shape[:2]
-        aligned_img = cv2.warpAffine(
-            img, 
-            matrix, 
-            (w_target, h_target), 
-            flags=cv2.INTER_LINEAR, 
-            borderMode=cv2.BORDER_CONSTANT, 
-            borderValue=0
-        )
-        return aligned_img
-    else:
-        raise ValueError("align_image: Could not compute affine transformation matrix.")
+    if matrix is None:
+        raise ValueError("estimate_align_matrix: Could not compute affine transformation matrix.")
+    return matrix
+
+
+def warp_by_align_matrix(img: np.ndarray, matrix: np.ndarray, target_shape: tuple[int, ...]) -> np.ndarray:
+    """
+    使用 estimate_align_matrix 得到的矩阵变换图像，输出大小与 target_shape 一致
+    """
+    h_target, w_target = target_shape[:2]
+    return cv2.warpAffine(
+        img, 
+        matrix, 
+        (w_target, h_target), 
+        flags=cv2.INTER_LINEAR, 
+        borderMode=cv2.BORDER_CONSTANT, 
+        borderValue=0
+    )
 
@@ -74,6 +74,43 @@ def comfirm_box(message: str, parent=None) -> bool:
     return result == QMessageBox.StandardButton.Yes
 
 
+def get_overlay_appearance(data: dict) -> dict:
+    """
+    从设置数据中取出主叠加层的外观设置，缺省值由 load_overlay_appearance 和 load_settings 共用
+    """
+    return {
+        "size": data.get("size", 200),
+        "opacity": data.get("opacity", 60),
+        "x": data.get("x"),
+        "y": data.get("y"),
+        "hide_text": data.get("hide_text", False),
+        "only_show_when_game_foreground": data.get("only_show_when_game_foreground", False),
+    }
+
+
+def load_overlay_appearance(overlay: OverlayWidget):
+    """
+    只加载主叠加层的外观设置（大小、透明度、位置、隐藏文字），在主叠加层显示前调用，
+    使首帧直接以保存的外观绘制。其余设置仍由 SettingsWindow.load_settings 加载
+    """
+    try:
+        data = load_yaml(SETTINGS_SAVE_PATH) if os.path.exists(SETTINGS_SAVE_PATH) else {}
+        appearance = get_overlay_appearance(data)
+        # 与 load_settings 的顺序一致：先大小和透明度，再位置
+        overlay.update_ui_state(OverlayUIState(
+            scale=appearance["size"] / 100.0,
+            opacity=appearance["opacity"] / 100.0,
+        ))
+        overlay.update_ui_state(OverlayUIState(
+            x=appearance["x"],
+            y=appearance["y"],
+            hide_text=appearance["hide_text"],
+            only_show_when_game_foreground=appearance["only_show_when_game_foreground"],
+        ))
+    except Exception as e:
+        error(f"Failed to load overlay appearance: {e}")
+
+
 class QuickTooltipLabel(QLabel):
     """快速显示tooltip的标签"""
     def __init__(self, text: str, parent=None):
@@ -682,20 +719,21 @@ class SettingsWindow(QWidget):
                 data = {}
                 warning(f"Settings file not found: {SETTINGS_SAVE_PATH}, using defaults")
             # 外观
-            load_slider_value(self.size_slider, data.get("size", 200))
-            load_slider_value(self.opacity_slider, data.get("opacity", 60))
+            appearance = get_overlay_appearance(data)
+            load_slider_value(self.size_slider, appearance["size"])
+            load_slider_value(self.opacity_slider, appearance["opacity"])
             self.update_overlay_ui_state_signal.emit(OverlayUIState(
-                x=data.get("x"),
-                y=data.get("y"),
+                x=appearance["x"],
+                y=appearance["y"],
             ))
-            load_checkbox_state(self.hide_text_checkbox, data.get("hide_text", False))
+            load_checkbox_state(self.hide_text_checkbox, appearance["hide_text"])
             # 快捷键
             self.day_input_setting_widget.set_setting(InputSetting.load_from_dict(data.get("day_input_setting")))
             self.forward_day_input_setting_widget.set_setting(InputSetting.load_from_dict(data.get("forward_day_input_setting")))
             self.back_day_input_setting_widget.set_setting(InputSetting.load_from_dict(data.get("back_day_input_setting")))
             self.in_rain_input_setting_widget.set_setting(InputSetting.load_from_dict(data.get("in_rain_input_setting")))
             # 性能
-            load_checkbox_state(self.only_show_when_game_foreground_checkbox, data.get("only_show_when_game_foreground", False))
+            load_checkbox_state(self.only_show_when_game_foreground_checkbox, appearance["only_show_when_game_foreground"])
             load_combobox_value(self.detect_interval_combobox, data.get("detect_interval", "高"))
             # 自动计时
             load_checkbox_state(self.dayx_detect_enable_checkbox, data.get("dayx_detect_enabled", True))